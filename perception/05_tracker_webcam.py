@@ -8,6 +8,7 @@ python run_webcam_example.py --use_region -b obj_000014 -m <path/to/obj/dir>
 import cv2
 import time
 import argparse
+import threading
 import numpy as np
 import quaternion
 
@@ -32,6 +33,7 @@ args = parse_script_input()
 
 # revover one image to get the camera resolution
 vid = cv2.VideoCapture(0) 
+vid.set(cv2.CAP_PROP_BUFFERSIZE, 1)  # do not queue stale frames
 ret, frame = vid.read()
 height, width, _ = frame.shape
 
@@ -74,41 +76,80 @@ optimizer.tikhonov_parameter_rotation *= scale_r
 optimizer.SetUp()
 #----------------------
 
-first = True
+#----------------
+# Grab frames in a background thread so that capture and tracking run concurrently:
+# the main loop waits for a new frame, then works on the latest one while the next is captured
+latest_frame = frame
+frame_id = 0  # id of latest_frame, incremented for each captured frame
+frame_cond = threading.Condition()
+stop_capture = threading.Event()
+
+def capture_frames():
+    global latest_frame, frame_id
+    while not stop_capture.is_set():
+        ret, frame = vid.read()
+        if not ret:
+            time.sleep(0.01)  # no frame available, e.g. camera disconnected: back off instead of spinning
+            continue
+        with frame_cond:
+            latest_frame = frame
+            frame_id += 1
+            frame_cond.notify()
+
+capture_thread = threading.Thread(target=capture_frames, daemon=True)
+capture_thread.start()
+#----------------
+
+VIEWER_PERIOD = 2  # while tracking, refresh the viewer every VIEWER_PERIOD processed frames only
+
+body.body2world_pose = body2world_pose  # simulate external initial pose
 tracking = False
 i = 0
+k = -1
+last_frame_id = -1
 print('\n------\nPress q to quit during execution')
 print('Press d to reset object pose (and stop tracking)')
 print('Press x to start tracking')
-while True: 
-	ret, frame = vid.read()
-	color_camera.image = frame
-	ok = tracker.UpdateCameras(True)  # poststep verifying the images have been properly setup
-	if not ok:
-		raise ValueError('Something is wrong with the provided images')
+try:
+	while True: 
+		with frame_cond:
+			if not frame_cond.wait_for(lambda: frame_id != last_frame_id, timeout=1.0):
+				raise ValueError('No new image from the webcam')
+			frame, last_frame_id = latest_frame, frame_id
+		color_camera.image = frame
       
-	k = cv2.waitKey(1)
-	if first or k == ord('d'):
-		body.body2world_pose = body2world_pose  # simulate external initial pose
-		first = False
-		tracking = False
-	if k == ord('x'):
-		tracking = True
-		print('StartTracking')
-	if k == ord('q'):
-		break
-	if tracking:
-		t = time.time()
-		#----------------------
-		# TODO: uncomment/comment to replace by simplified implementation 
-		tracker.ExecuteTrackingStep(i)
-		# ExecuteTrackingStepSingleObject(tracker, link, body, i, optimizer.tikhonov_parameter_translation, optimizer.tikhonov_parameter_rotation)
-		print('ExecuteTrackingCycle (ms)', 1000*(time.time() - t))
-		print('body.body2world_pose\n',body.body2world_pose)
-		#----------------------
-
-	i += 1
-	color_viewer.UpdateViewer(i)
-
-vid.release() 
-cv2.destroyAllWindows() 
+		# k was polled at the end of the previous iteration
+		if k == ord('d'):
+			body.body2world_pose = body2world_pose  # simulate external initial pose
+			tracking = False
+		if k == ord('x'):
+			tracking = True
+			print('StartTracking')
+		if k == ord('q'):
+			break
+		if tracking:
+			# The tracker only needs the new images once tracking has started
+			ok = tracker.UpdateCameras(True)  # poststep verifying the images have been properly setup
+			if not ok:
+				raise ValueError('Something is wrong with the provided images')
+			t = time.time()
+			#----------------------
+			# TODO: uncomment/comment to replace by simplified implementation 
+			tracker.ExecuteTrackingStep(i)
+			# ExecuteTrackingStepSingleObject(tracker, link, body, i, optimizer.tikhonov_parameter_translation, optimizer.tikhonov_parameter_rotation)
+			print('ExecuteTrackingCycle (ms)', 1000*(time.time() - t))
+			print('body.body2world_pose\n',body.body2world_pose)
+			#----------------------
+
+		i += 1  # one iteration per new camera frame: i counts the processed frames
+		# Before tracking, refresh every frame to help aligning the object with its initial pose
+		k = -1
+		if not tracking or i % VIEWER_PERIOD == 0:
+			color_viewer.UpdateViewer(i)
+			k = cv2.waitKey(1)  # also repaints the viewer window, only needed when it was updated
+finally:
+	# Stop the capture thread and release the camera on every exit path, errors included
+	stop_capture.set()
+	capture_thread.join()
+	vid.release()
+	cv2.destroyAllWindows()
@@ -2,7 +2,7 @@ import time
 
 import numpy as np
 import pinocchio as pin
-from numpy.linalg import det, eig, inv, norm, pinv, svd
+from numpy.linalg import norm
 
 import vizutils
 
@@ -15,6 +15,8 @@ class Cost3d:
         self.ptarget = ptarget if ptarget is not None else  np.array([0.5, 0.1, 0.27])
         self.frame_index = frame_index if frame_index is not None else rmodel.nframes - 1
         self.viz = viz
+        self._viz_dt = 0.033  # minimal time between two displays in callback (s)
+        self._last_viz_t = 0.0
 
     def residual(self, q):
         pin.framesForwardKinematics(self.rmodel, self.rdata, q)
@@ -22,25 +24,33 @@ class Cost3d:
         return M.translation - self.ptarget
 
     def calc(self, q):
-        return sum(self.residual(q) ** 2)
+        r = self.residual(q)
+        return float(r @ r)
 
     # --- Callback
     def callback(self, q):
+        '''
+        Display q, at most once every _viz_dt seconds. The last iterate of an optimizer may
+        then not be displayed: call viz.display on the solution once the optimizer returns.
+        '''
         if self.viz is None:
             return
+        now = time.time()
+        if now - self._last_viz_t < self._viz_dt:
+            return  # Limit the display rate instead of slowing the solver down
+        self._last_viz_t = now
         pin.framesForwardKinematics(self.rmodel, self.rdata, q)
         M = self.rdata.oMf[self.frame_index]
         vizutils.applyViewerConfiguration(self.viz, 'world/ball', pin.SE3ToXYZQUATtuple(M))
         vizutils.applyViewerConfiguration(self.viz, 'world/box', self.ptarget.tolist() + [1, 0, 0, 0])
         self.viz.display(q)
-        time.sleep(1e-2)
 
     def calcDiff(self, q):
-        pin.framesForwardKinematics(self.rmodel, self.rdata, q)
-        pin.computeJointJacobians(self.rmodel, self.rdata, q)
-        M = self.rdata.oMf[self.frame_index]
-        J = pin.getFrameJacobian(self.rmodel, self.rdata, self.frame_index, pin.LOCAL_WORLD_ALIGNED)[:3, :]
-        return 2 * J.T @ (M.translation - self.ptarget)
+        r = self.residual(q)
+        # Translational rows in LOCAL, rotated to the world axes: same as LOCAL_WORLD_ALIGNED[:3]
+        J = pin.computeFrameJacobian(self.rmodel, self.rdata, q, self.frame_index, pin.LOCAL)[:3, :]
+        R = self.rdata.oMf[self.frame_index].rotation
+        return 2 * (R @ J).T @ r
 
 
 # COST 6D #####################################################################
@@ -52,6 +62,8 @@ class Cost6d:
                                                                    np.array([0.5, 0.1, 0.27]))  # x, y, z
         self.frame_index = frame_index if frame_index is not None else rmodel.nframes-1
         self.viz = viz
+        self._viz_dt = 0.033  # minimal time between two displays in callback (s)
+        self._last_viz_t = 0.0
 
     def residual(self, q):
         '''Compute score from a configuration'''
@@ -61,19 +73,25 @@ class Cost6d:
         return pin.log(self.deltaM).vector
 
     def calc(self, q):
-        return sum(self.residual(q) ** 2)
+        r = self.residual(q)
+        return float(r @ r)
 
     def callback(self, q):
         if self.viz is None:
             return
+        now = time.time()
+        if now - self._last_viz_t < self._viz_dt:
+            return  # Limit the display rate instead of slowing the solver down
+        self._last_viz_t = now
+        pin.framesForwardKinematics(self.rmodel, self.rdata, q)
+        M = self.rdata.oMf[self.frame_index]
         vizutils.applyViewerConfiguration(self.viz, 'world/ball', pin.SE3ToXYZQUATtuple(M))
         vizutils.applyViewerConfiguration(self.viz, 'world/box', pin.SE3ToXYZQUATtuple(self.Mtarget))
         self.viz.display(q)
-        time.sleep(1e-2)
 
     def calcDiff(self, q):
-        J = pin.computeFrameJacobian(self.rmodel, self.rdata, q, self.frame_index)
         r = self.residual(q)
+        J = pin.computeFrameJacobian(self.rmodel, self.rdata, q, self.frame_index)
         Jlog = pin.Jlog6(self.deltaM)
         return 2 * J.T @ Jlog.T @ r
 
@@ -82,17 +100,33 @@ class Cost6d:
 class CostPosture:
     def __init__(self, rmodel, rdata, qref=None, viz=None):
         # viz, rmodel and rdata are taken to respect the API but are not useful.
-        self.qref = qref if qref is not None else pin.randomConfiguration(rmodel)
+        self.rmodel = rmodel
         self.removeFreeFlyer = rmodel.joints[1].nq == 7  # Don't penalize the free flyer if any.
+        self.qref = qref if qref is not None else pin.randomConfiguration(rmodel)
+
+    @property
+    def qref(self):
+        return self._qref
+
+    @qref.setter
+    def qref(self, qref):
+        self._qref = qref
+        self.qref_tail = qref[7:] if self.removeFreeFlyer else qref
 
     def residual(self, q):
-        if self.removeFreeFlyer:
-            return (q - self.qref)[7:]
-        else:
-            return q - self.qref
+        return (q[7:] if self.removeFreeFlyer else q) - self.qref_tail
+
+    def residual_batch(self, Q):
+        '''Residuals of all the configurations stored in the columns of Q at once.'''
+        return (Q[7:] if self.removeFreeFlyer else Q) - self.qref_tail[:, None]
+
+    def calc_batch(self, Q):
+        R = self.residual_batch(Q)
+        return np.sum(R * R, axis=0)
 
     def calc(self, q):
-        return sum(self.residual(q) ** 2)
+        r = self.residual(q)
+        return float(r @ r)
 
     def calcDiff(self, q):
         if self.removeFreeFlyer:
@@ -114,7 +148,8 @@ class CostGravity:
         return pin.computeGeneralizedGravity(self.rmodel, self.rdata, q)
 
     def calc(self, q):
-        return sum(self.residual(q) ** 2)
+        r = self.residual(q)
+        return float(r @ r)
 
     def calcDiff(self, q):
         g = self.residual(q)
@@ -148,16 +183,31 @@ class CostPostureDiff:
     def __init__(self, rmodel, rdata, qref=None, viz=None):
         self.rmodel = rmodel
         self.qref = qref if qref is not None else pin.randomConfiguration(rmodel)
+        # d difference(q, qref) / dq is -1 for 1-dof joints (revolute, prismatic): if all the joints
+        # but the free flyer are of this kind, only the 6x6 free-flyer block has to be evaluated.
+        self._freeflyer = rmodel.joints[1].nq == 7
+        self._sparse = all(j.nv == 1 for j in rmodel.joints[2 if self._freeflyer else 1:])
+        if self._freeflyer:
+            self._ffmodel = pin.Model()
+            self._ffmodel.addJoint(0, pin.JointModelFreeFlyer(), pin.SE3.Identity(), 'root_joint')
 
     def residual(self, q):
         return pin.difference(self.rmodel, q, self.qref)
 
     def calc(self, q):
-        return sum(self.residual(q) ** 2)
+        r = self.residual(q)
+        return float(r @ r)
 
     def calcDiff(self, q):
-        J, _ = pin.dDifference(self.rmodel, q, self.qref)
-        return 2 * J.T @ self.residual(q)
+        r = self.residual(q)
+        if not self._sparse:
+            J = pin.dDifference(self.rmodel, q, self.qref, pin.ARG0)
+            return 2 * J.T @ r
+        g = -2 * r
+        if self._freeflyer:
+            Jff = pin.dDifference(self._ffmodel, q[:7], self.qref[:7], pin.ARG0)
+            g[:6] = 2 * Jff.T @ r[:6]
+        return g
 
 # TESTS ###
 # TESTS ###
@@ -168,22 +218,26 @@ if __name__ == "__main__":
     import example_robot_data as robex
     import copy
 
-    def Tdiff1(func, exp, nv, q, eps=1e-6):
+    def Tdiff1(func, exp, nv, q, eps=1e-6, func_batch=None):
         '''
-        Num diff for a function whose input is in a manifold
+        Num diff for a function whose input is in a manifold.
+        If given, func_batch evaluates func on each column of a matrix of configurations,
+        and is called once on all the perturbed configurations.
         '''
         f0 = copy.copy(func(q))
-        fs = []
+        inv_eps = 1.0 / eps
+        if func_batch is not None:
+            V = eps * np.eye(nv)
+            Q = np.stack([exp(q, V[:, k]) for k in range(nv)], axis=1)
+            return (func_batch(Q) - np.asarray(f0)[..., None]) * inv_eps
+        J = np.empty(np.shape(f0) + (nv,))  # (nv,) for a scalar func, (len(f0), nv) for a vector one
         v = np.zeros(nv)
         for k in range(nv):
             v[k] = eps
             qk = exp(q, v)
-            fs.append((func(qk)-f0)/eps)
-            v[k] -= eps
-        if isinstance(fs[0], np.ndarray) and len(fs[0]) > 1:
-            return np.stack(fs, axis=1)
-        else:
-            return np.array(fs)
+            J[..., k] = (func(qk) - f0) * inv_eps
+            v[k] = 0.0
+        return J
 
 
     # Num diff checking, for each cost.
@@ -191,8 +245,8 @@ if __name__ == "__main__":
 
     q = pin.randomConfiguration(robot.model)
     # Tdiffq is used to compute the tangent application in the configuration space.
-    def Tdiffq(f, q):
-        return Tdiff1(f, lambda q, v: pin.integrate(robot.model, q, v), robot.model.nv, q)
+    def Tdiffq(f, q, f_batch=None):
+        return Tdiff1(f, lambda q, v: pin.integrate(robot.model, q, v), robot.model.nv, q, func_batch=f_batch)
 
     # Test Cost3d
     CostClass = Cost3d
@@ -212,7 +266,7 @@ if __name__ == "__main__":
     CostClass = CostPosture
     cost = CostClass(robot.model, robot.data)
     Tg = cost.calcDiff(q)
-    Tgn = Tdiffq(cost.calc, q)
+    Tgn = Tdiffq(cost.calc, q, cost.calc_batch)
     assert norm(Tg - Tgn) < 1e-4
 
     ### Test CostGravity
@@ -21,6 +21,7 @@ mycost = SumOfCostFreeFlyer(rmodel, rdata,
                             [Cost3d(rmodel, rdata, ptarget=np.array([2, 2, -1]), viz=viz),
                              CostPosture(rmodel, rdata)], [1, 1e-3])
 qopt = fmin_bfgs(mycost.calc, robot.q0, callback=mycost.callback)
+viz.display(qopt)
 
 # Solution to 2.2
 cost6d = Cost6d(rmodel, rdata)